@@ -0,0 +1,544 @@
+"""
+Module: Board Analysis
+
+Description:
+Survival analysis of the snake board for use by autopilot policies. For
+each direction the snake head could move in, the analyzer computes the
+number of empty cells reachable after the move and whether the tail can
+still be reached.
+
+The board is stored as a bitset (a Python int with one bit per cell) so the
+flood fill advances a whole frontier with a handful of shifts per step
+instead of visiting cells one at a time.
+
+The snake bitset and the connected regions of empty cells are kept between
+ticks. When the snake moves one step only the freed tail cell and the new
+head cell (and the segment added when growing) are applied: a freed cell
+joins the regions next to it, and a covered cell only triggers a search
+when the cells around it show that its region may have been cut in two.
+Everything is rebuilt from the snake cells after a reset or when
+wraparound is toggled.
+
+Moves onto the food follow SnakeModel.grow_snake: the tail still moves
+and a new segment is appended in line with the last two segments. When
+grow_snake would put that segment off the board, or cannot place it
+because the last two segments are not next to each other on the board,
+the move is treated as if the snake did not grow.
+
+"""
+
+import re
+
+from snake7 import Direction
+
+
+# Cells around a cell in ring order, starting north and going clockwise; the
+# even positions are the four neighbours the snake can move to
+RING = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+
+# Consecutive cells of a region in the binary digits of its bitset
+CELL_RUN = re.compile("1+")
+
+
+class MoveAnalysis:
+    """ Result of analyzing a single candidate move """
+    def __init__(self, direction, target, region_size, tail_reachable):
+        self.direction = direction
+        self.target = target
+        self.region_size = region_size
+        self.tail_reachable = tail_reachable
+
+    # A move is safe if it does not end the game
+    @property
+    def is_safe(self):
+        return self.target is not None
+
+    def __repr__(self):
+        return ("MoveAnalysis({}, target={}, region_size={}, "
+                "tail_reachable={})".format(self.direction.name, self.target,
+                                            self.region_size,
+                                            self.tail_reachable))
+
+
+class BoardAnalyzer:
+    """ Flood-fill analysis of a SnakeModel board """
+    def __init__(self, model):
+        self.model = model
+        self.num_rows = model.num_rows
+        self.num_cols = model.num_cols
+        num_cells = self.num_rows * self.num_cols
+
+        # Masks used to shift the frontier without crossing the board edges
+        self.full_mask = (1 << num_cells) - 1
+        self.first_col_mask = 0
+        for r in range(self.num_rows):
+            self.first_col_mask |= 1 << (r * self.num_cols)
+        self.last_col_mask = self.first_col_mask << (self.num_cols - 1)
+        self.first_row_mask = (1 << self.num_cols) - 1
+        self.last_row_mask = self.first_row_mask << (num_cells - self.num_cols)
+        self.not_first_col_mask = self.full_mask & ~self.first_col_mask
+        self.not_last_col_mask = self.full_mask & ~self.last_col_mask
+
+        # Snake bitset carried between ticks, with the number of segments on
+        # each cell since growing can stack a segment on an occupied cell
+        self.snake_mask = 0
+        self.segment_counts = {}
+        self.last_head = None
+        self.last_tail = None
+        self.last_length = 0
+
+        # Connected areas of empty cells, carried between ticks. Each area
+        # has an id with its cells and size; every empty cell records the id
+        # of its area, and ids of areas that were joined point to the id
+        # they were joined into
+        self.region_cells = {}
+        self.region_sizes = {}
+        self.region_parents = {}
+        self.cell_regions = [None] * num_cells
+        self.next_region_id = 0
+        self.regions_wraparound = None
+
+        # Last region split, which analyze() works out for the move onto the
+        # food and the next update reuses when the snake takes that move
+        self.last_split = None
+
+        # Result of the last analysis and the board it was computed for
+        self.cached_key = None
+        self.cached_result = None
+
+    # List of the connected areas of empty cells
+    @property
+    def regions(self):
+        return list(self.region_cells.values())
+
+    # Method to return the bit of the cell at the given row and column
+    def cell_bit(self, row, col):
+        if 0 <= row < self.num_rows and 0 <= col < self.num_cols:
+            return 1 << (row * self.num_cols + col)
+        return 0
+
+    # Method to return the indices of the cells next to the given cell
+    def neighbour_indices(self, row, col):
+        indices = []
+        for d_row, d_col in RING[::2]:
+            r = row + d_row
+            c = col + d_col
+            if self.model.wraparound:
+                r %= self.num_rows
+                c %= self.num_cols
+            if 0 <= r < self.num_rows and 0 <= c < self.num_cols:
+                indices.append(r * self.num_cols + c)
+        return indices
+
+    # Method to rebuild the snake bitset and the empty regions from scratch
+    def rebuild(self):
+        self.snake_mask = 0
+        self.segment_counts = {}
+        for cell in self.model.snake_cells:
+            count = self.segment_counts.get(cell, 0)
+            self.segment_counts[cell] = count + 1
+            self.snake_mask |= self.cell_bit(*cell)
+        self.rebuild_regions()
+
+    # Method to split the empty cells into connected regions
+    def rebuild_regions(self):
+        self.region_cells = {}
+        self.region_sizes = {}
+        self.region_parents = {}
+        self.cell_regions = [None] * (self.num_rows * self.num_cols)
+        remaining = self.full_mask & ~self.snake_mask
+        while remaining:
+            region = self.flood_fill(remaining & -remaining, remaining)
+            self.add_region(region, bin(region).count("1"))
+            remaining &= ~region
+        self.regions_wraparound = self.model.wraparound
+
+    # Method to record a new region and label its cells with its id
+    def add_region(self, region, size):
+        region_id = self.next_region_id
+        self.next_region_id += 1
+        self.region_cells[region_id] = region
+        self.region_sizes[region_id] = size
+
+        # Label each run of cells read off the binary digits of the region,
+        # lowest cell first
+        digits = bin(region)[:1:-1]
+        for run in CELL_RUN.finditer(digits):
+            start, end = run.span()
+            self.cell_regions[start:end] = [region_id] * (end - start)
+        return region_id
+
+    # Method to return the id of the region holding a cell, or None if the
+    # cell is covered by the snake
+    def region_of(self, index):
+        region_id = self.cell_regions[index]
+        if region_id is None:
+            return None
+        root = region_id
+        while root in self.region_parents:
+            root = self.region_parents[root]
+        while region_id != root:
+            # Point every id on the way straight at the region it is in
+            next_id = self.region_parents[region_id]
+            self.region_parents[region_id] = root
+            region_id = next_id
+        self.cell_regions[index] = root
+        return root
+
+    # Method to bring the snake bitset and regions up to date with the model
+    def update_board(self):
+        cells = self.model.snake_cells
+        step = self.local_step(cells)
+        if step is None:
+            self.rebuild()
+        elif step:
+            # The model drops the tail before adding the new head, and
+            # grow_snake appends one more segment after that. The grown
+            # segment is applied before the head, which leaves the same
+            # board and lets it reuse the split analyze() worked out
+            self.remove_segment(self.last_tail)
+            if len(cells) > self.last_length:
+                self.add_segment(cells[-1])
+            self.add_segment(cells[0])
+        if self.regions_wraparound != self.model.wraparound:
+            self.rebuild_regions()
+
+        self.last_head = cells[0]
+        self.last_tail = cells[-1]
+        self.last_length = len(cells)
+
+    # Method to classify the change since the last update
+    # Returns False if the snake has not moved, True if it moved one step,
+    # possibly growing, and None if the board has to be rebuilt
+    def local_step(self, cells):
+        if self.last_head is None:
+            return None
+        if cells[0] == self.last_head and len(cells) == self.last_length:
+            return False
+        if len(cells) - self.last_length not in (0, 1):
+            return None
+        if self.last_length == 1 or cells[1] == self.last_head:
+            return True
+        return None
+
+    # Method to put one snake segment on a cell
+    def add_segment(self, cell):
+        count = self.segment_counts.get(cell, 0)
+        self.segment_counts[cell] = count + 1
+        bit = self.cell_bit(*cell)
+        if count == 0 and bit:
+            self.snake_mask |= bit
+            self.block_cell(cell, bit)
+
+    # Method to take one snake segment off a cell
+    def remove_segment(self, cell):
+        count = self.segment_counts[cell] - 1
+        if count:
+            self.segment_counts[cell] = count
+            return
+        del self.segment_counts[cell]
+        bit = self.cell_bit(*cell)
+        if bit:
+            self.snake_mask &= ~bit
+            self.free_cell(cell, bit)
+
+    # Method to add a newly emptied cell to the regions, joining the regions
+    # next to it into the largest of them
+    def free_cell(self, cell, bit):
+        index = cell[0] * self.num_cols + cell[1]
+        roots = self.neighbour_regions(cell)
+        if not roots:
+            self.cell_regions[index] = self.add_region(bit, 1)
+            return
+
+        root = max(roots, key=lambda region_id: self.region_sizes[region_id])
+        region = self.region_cells[root] | bit
+        size = self.region_sizes[root] + 1
+        for other in roots:
+            if other != root:
+                region |= self.region_cells.pop(other)
+                size += self.region_sizes.pop(other)
+                self.region_parents[other] = root
+        self.region_cells[root] = region
+        self.region_sizes[root] = size
+        self.cell_regions[index] = root
+
+    # Method to return the ids of the regions next to a cell
+    def neighbour_regions(self, cell):
+        roots = set()
+        for index in self.neighbour_indices(cell[0], cell[1]):
+            root = self.region_of(index)
+            if root is not None:
+                roots.add(root)
+        return roots
+
+    # Method to remove a newly covered cell from its region
+    # The largest piece keeps the region's id, so only the cells of the
+    # smaller pieces are labelled again
+    def block_cell(self, cell, bit):
+        index = cell[0] * self.num_cols + cell[1]
+        root = self.region_of(index)
+        self.cell_regions[index] = None
+        if root is None:
+            return
+
+        pieces = self.remove_from_region(self.region_cells[root], cell, bit)
+        if not pieces:
+            del self.region_cells[root]
+            del self.region_sizes[root]
+            return
+        if len(pieces) == 1:
+            self.region_cells[root] = pieces[0]
+            self.region_sizes[root] -= 1
+            return
+
+        sizes = [bin(piece).count("1") for piece in pieces]
+        largest = sizes.index(max(sizes))
+        self.region_cells[root] = pieces[largest]
+        self.region_sizes[root] = sizes[largest]
+        for i in range(len(pieces)):
+            if i != largest:
+                self.add_region(pieces[i], sizes[i])
+
+    # Method to return the pieces a region falls into when a cell is removed
+    def remove_from_region(self, region, cell, bit):
+        key = (region, bit, self.model.wraparound)
+        if self.last_split is not None and self.last_split[0] == key:
+            return self.last_split[1]
+
+        region &= ~bit
+        if not region:
+            pieces = []
+        else:
+            seeds = self.split_seeds(region, cell)
+            if len(seeds) <= 1:
+                pieces = [region]
+            else:
+                pieces = self.split_region(region, seeds)
+        self.last_split = (key, pieces)
+        return pieces
+
+    # Method to find one neighbour of a removed cell for each side of it that
+    # may have been cut off from the others
+    # Neighbours joined through the ring of eight cells around the removed
+    # cell stay connected, so only one of them needs to be searched from
+    def split_seeds(self, region, cell):
+        ring = []
+        row = cell[0]
+        col = cell[1]
+        for d_row, d_col in RING:
+            r = row + d_row
+            c = col + d_col
+            if self.model.wraparound:
+                r %= self.num_rows
+                c %= self.num_cols
+            ring.append(self.cell_bit(r, c) & region)
+
+        if all(ring):
+            return [ring[0]]
+        if self.num_rows < 3 or self.num_cols < 3:
+            # The ring overlaps itself on tiny boards, so search from every
+            # neighbour
+            return [ring[i] for i in range(0, len(RING), 2) if ring[i]]
+
+        # Walk the ring once from a covered cell, keeping the first
+        # neighbour of every run of empty cells
+        start = ring.index(0)
+        seeds = []
+        seed = None
+        for i in range(start + 1, start + len(RING) + 1):
+            open_bit = ring[i % len(RING)]
+            if not open_bit:
+                if seed is not None:
+                    seeds.append(seed)
+                    seed = None
+            elif i % 2 == 0 and seed is None:
+                seed = open_bit
+        return seeds
+
+    # Method to return the cells reachable in one step from the given cells
+    def spread(self, cells):
+        # Bits shifted past the last row are dropped by the caller's mask
+        cols = self.num_cols
+        result = (cells << cols) | (cells >> cols)
+        result |= (cells << 1) & self.not_first_col_mask
+        result |= (cells >> 1) & self.not_last_col_mask
+        if self.model.wraparound:
+            num_cells = self.num_rows * cols
+            result |= (cells & self.first_col_mask) << (cols - 1)
+            result |= (cells & self.last_col_mask) >> (cols - 1)
+            result |= (cells & self.first_row_mask) << (num_cells - cols)
+            result |= (cells & self.last_row_mask) >> (num_cells - cols)
+        return result
+
+    # Method to flood fill the open cells starting from the given cells
+    def flood_fill(self, start, open_cells):
+        remaining = open_cells & ~start
+        frontier = start
+        while frontier:
+            frontier = self.spread(frontier) & remaining
+            remaining ^= frontier
+        return (open_cells | start) & ~remaining
+
+    # Method to split a region into its connected pieces
+    # One fill is grown from each seed in turn and fills that meet are
+    # joined, so the search stops as soon as all but one have run out and
+    # the cost depends on the smaller pieces rather than the whole region
+    def split_region(self, region, seeds):
+        claimed = list(seeds)
+        frontiers = list(seeds)
+        unclaimed = region
+        for seed in seeds:
+            unclaimed &= ~seed
+
+        while sum(1 for frontier in frontiers if frontier) > 1:
+            for i in range(len(frontiers)):
+                if not frontiers[i]:
+                    continue
+                # Claimed and unclaimed cells all lie inside the region
+                reach = self.spread(frontiers[i])
+                joined = 0
+                for j in range(len(frontiers)):
+                    if j != i and claimed[j] & reach:
+                        claimed[i] |= claimed[j]
+                        joined |= frontiers[j]
+                        claimed[j] = 0
+                        frontiers[j] = 0
+                grown = reach & unclaimed
+                unclaimed ^= grown
+                claimed[i] |= grown
+                frontiers[i] = grown | joined
+
+        pieces = []
+        finished = 0
+        for i in range(len(frontiers)):
+            if claimed[i] and not frontiers[i]:
+                pieces.append(claimed[i])
+                finished |= claimed[i]
+        if region & ~finished:
+            pieces.append(region & ~finished)
+        return pieces
+
+    # Method to return the cell the head moves to, or None if the move is fatal
+    def target_cell(self, direction):
+        head = self.model.snake_head
+        row = head[0]
+        col = head[1]
+        if direction == Direction.NORTH:
+            row -= 1
+        elif direction == Direction.SOUTH:
+            row += 1
+        elif direction == Direction.WEST:
+            col -= 1
+        elif direction == Direction.EAST:
+            col += 1
+
+        if self.model.is_boundary(row, col):
+            if not self.model.wraparound:
+                return None
+            row %= self.num_rows
+            col %= self.num_cols
+        return (row, col)
+
+    # Method to analyze every direction the snake head could move in
+    def analyze(self):
+        self.update_board()
+        cells = self.model.snake_cells
+        food = self.model.food
+        tail = cells[-1]
+        key = (self.snake_mask, self.model.snake_head, tail, food,
+               self.model.wraparound)
+        if key == self.cached_key:
+            return self.cached_result
+
+        # The tail moves out of the way, joining the regions next to it
+        tail_bit = self.cell_bit(*tail)
+        tail_roots = set()
+        tail_region = 0
+        tail_size = 0
+        if tail_bit and self.segment_counts[tail] == 1:
+            tail_roots = self.neighbour_regions(tail)
+            tail_region = tail_bit
+            tail_size = 1
+            for root in tail_roots:
+                tail_region |= self.region_cells[root]
+                tail_size += self.region_sizes[root]
+        new_tail = cells[-2] if len(cells) >= 2 else None
+        new_tail_bit = self.cell_bit(*new_tail) if new_tail else 0
+
+        result = {}
+        for direction in Direction:
+            target = self.target_cell(direction)
+            target_bit = self.cell_bit(*target) if target else 0
+            region = 0
+            region_size = 0
+            if target_bit and tail_region & target_bit:
+                region = tail_region
+                region_size = tail_size
+            elif target_bit:
+                root = self.region_of(target[0] * self.num_cols + target[1])
+                if root is not None:
+                    region = self.region_cells[root]
+                    region_size = self.region_sizes[root]
+            if not region:
+                result[direction] = MoveAnalysis(direction, None, 0, False)
+                continue
+
+            goal_bit = new_tail_bit
+            if target == food:
+                # grow_snake appends a segment behind the new tail, which
+                # blocks its cell and becomes the tail
+                grown = self.grown_segment(target, direction)
+                grown_bit = self.cell_bit(*grown) if grown else 0
+                if grown_bit and grown_bit != target_bit:
+                    goal_bit = grown_bit
+                    if region & grown_bit:
+                        pieces = self.remove_from_region(region, grown,
+                                                         grown_bit)
+                        if len(pieces) == 1:
+                            region = pieces[0]
+                            region_size -= 1
+                        else:
+                            for piece in pieces:
+                                if piece & target_bit:
+                                    region = piece
+                            region_size = bin(region).count("1")
+                elif new_tail is None:
+                    goal_bit = 0
+
+            if goal_bit:
+                tail_reachable = bool(self.spread(goal_bit) & region)
+            else:
+                tail_reachable = True
+            result[direction] = MoveAnalysis(direction, target,
+                                             region_size - 1, tail_reachable)
+
+        self.cached_key = key
+        self.cached_result = result
+        return result
+
+    # Method to return the segment grow_snake appends when the snake eats
+    # after moving to the target, or None if grow_snake cannot place one
+    def grown_segment(self, target, direction):
+        cells = self.model.snake_cells
+        if len(cells) == 1:
+            # The new segment goes behind the head, against the direction
+            if direction == Direction.NORTH:
+                return (target[0] + 1, target[1])
+            elif direction == Direction.SOUTH:
+                return (target[0] - 1, target[1])
+            elif direction == Direction.EAST:
+                return (target[0], target[1] - 1)
+            elif direction == Direction.WEST:
+                return (target[0], target[1] + 1)
+
+        # Otherwise it extends the line of the last two segments
+        end_of_snake = cells[-2]
+        piece_before_end = cells[-3] if len(cells) >= 3 else target
+        d_row = end_of_snake[0] - piece_before_end[0]
+        d_col = end_of_snake[1] - piece_before_end[1]
+        if d_row in (1, -1):
+            return (end_of_snake[0] + d_row, end_of_snake[1])
+        elif d_col in (1, -1):
+            return (end_of_snake[0], end_of_snake[1] + d_col)
+        return None
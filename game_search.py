@@ -0,0 +1,426 @@
+"""
+Module: Game Search
+
+Description:
+Short-horizon lookahead search for the snake game. The search is an
+expectimax over the snake's moves and the random food placement done by
+SnakeModel.make_food, and can be used as a reference opponent or to tune
+difficulty through the search depth.
+
+Moves onto the food follow SnakeModel.grow_snake: the tail still moves and
+a new segment is appended in line with the last two segments. When
+grow_snake would put that segment off the board, or cannot place it, the
+snake is treated as not growing, as in board_analysis.
+
+Instead of copying the model for every node, the search works on a
+SearchState that applies and undoes moves in place. Positions are keyed by
+a Zobrist hash of the head, the body, the food and the wraparound setting
+so that values can be reused from a bounded transposition table.
+
+"""
+
+import random
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from snake7 import Direction
+
+
+DIRECTION_DELTAS = {Direction.NORTH: (-1, 0), Direction.SOUTH: (1, 0),
+                    Direction.WEST: (0, -1), Direction.EAST: (0, 1)}
+
+# Moves are referred to by their index in these lists during the search
+DIRECTIONS = list(Direction)
+DELTAS = [DIRECTION_DELTAS[direction] for direction in DIRECTIONS]
+
+# Zobrist piece kinds: a body segment linked to the segment in front of it
+# in one of the four directions, the head, the food, and a body segment
+# whose link is not a single step
+HEAD = len(DIRECTIONS)
+FOOD = HEAD + 1
+UNLINKED = HEAD + 2
+NUM_KINDS = HEAD + 3
+
+DEATH_VALUE = -1000.0
+FULL_BOARD_VALUE = 1000.0
+
+
+class SearchState:
+    """ Snake position that supports cheap make and unmake moves """
+    def __init__(self, num_rows, num_cols, snake_cells, food, wraparound,
+                 zobrist):
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.wraparound = wraparound
+        self.zobrist = zobrist
+        self.body = deque(snake_cells)
+        self.links = deque()
+        self.occupied = {}
+        self.food = None
+        self.hash = 0
+
+        # The link recorded for each move; on boards one or two cells wide
+        # two directions take the same step, so the step alone cannot tell
+        # them apart and the segment is recorded as unlinked on every path
+        steps = [(delta[0] % num_rows, delta[1] % num_cols) for delta in DELTAS]
+        self.move_links = [index if steps.count(step) == 1 else UNLINKED
+                           for index, step in enumerate(steps)]
+
+        for i, cell in enumerate(self.body):
+            link = HEAD if i == 0 else self.link_between(cell,
+                                                         self.body[i - 1])
+            self.links.append(link)
+            self.hash ^= self.key(cell, link)
+            self.occupied[cell] = self.occupied.get(cell, 0) + 1
+
+        # Empty cells in a list for sampling, with each cell's position in
+        # it, built the first time the food has to be placed
+        self.empty = None
+        self.empty_index = None
+        if food is not None:
+            self.set_food(food)
+        if wraparound:
+            # The same snake has different moves with wraparound toggled
+            self.hash ^= self.zobrist[-1]
+
+    # Method to return the Zobrist key of a piece on a cell
+    def key(self, cell, kind):
+        row = cell[0] % self.num_rows
+        col = cell[1] % self.num_cols
+        return self.zobrist[(row * self.num_cols + col) * NUM_KINDS + kind]
+
+    # Method to compute the link leading from one cell to another
+    def link_between(self, cell, next_cell):
+        d_row = (next_cell[0] - cell[0]) % self.num_rows
+        d_col = (next_cell[1] - cell[1]) % self.num_cols
+        for index, delta in enumerate(DELTAS):
+            if (d_row == delta[0] % self.num_rows
+                    and d_col == delta[1] % self.num_cols):
+                return self.move_links[index]
+        return UNLINKED
+
+    # Method to place the food on the given cell
+    def set_food(self, cell):
+        self.food = cell
+        self.hash ^= self.key(cell, FOOD)
+
+    # Method to remove the food from the board
+    def clear_food(self):
+        self.hash ^= self.key(self.food, FOOD)
+        self.food = None
+
+    # Method to return the cell the head moves to, or None if it leaves the board
+    def target_cell(self, index):
+        head = self.body[0]
+        row = head[0] + DELTAS[index][0]
+        col = head[1] + DELTAS[index][1]
+        if not (0 <= row < self.num_rows and 0 <= col < self.num_cols):
+            if not self.wraparound:
+                return None
+            row %= self.num_rows
+            col %= self.num_cols
+        return (row, col)
+
+    # Method to move the head in the given direction
+    # Returns the information needed to undo the move, or None if the move
+    # ends the game, in which case the state is left unchanged
+    def make_move(self, index):
+        target = self.target_cell(index)
+        if target is None:
+            return None
+
+        # The tail moves out of the way before the head is checked
+        tail = self.body[-1]
+        self.release(tail)
+        if self.occupied.get(target, 0) > 0:
+            self.occupy(tail)
+            return None
+
+        head = self.body[0]
+        link = self.move_links[index]
+        self.hash ^= self.key(head, HEAD) ^ self.key(head, link)
+        self.links[0] = link
+        self.body.appendleft(target)
+        self.links.appendleft(HEAD)
+        self.hash ^= self.key(target, HEAD)
+        self.occupy(target)
+
+        self.body.pop()
+        tail_link = self.links.pop()
+        self.hash ^= self.key(tail, tail_link)
+
+        ate = target == self.food
+        grown = None
+        if ate:
+            self.clear_food()
+            grown = self.grown_segment(index)
+            if grown is not None:
+                link = self.link_between(grown, self.body[-1])
+                self.body.append(grown)
+                self.links.append(link)
+                self.hash ^= self.key(grown, link)
+                self.occupy(grown)
+        return (tail, tail_link, ate, grown)
+
+    # Method to return the segment SnakeModel.grow_snake appends after the
+    # head moved in the given direction, or None if it places none on the
+    # board, in which case the snake is treated as not growing
+    def grown_segment(self, index):
+        end_of_snake = self.body[-1]
+        if len(self.body) == 1:
+            # The new segment goes behind the head, against the direction
+            grown = (end_of_snake[0] - DELTAS[index][0],
+                     end_of_snake[1] - DELTAS[index][1])
+        else:
+            # Otherwise it extends the line of the last two segments
+            piece_before_end = self.body[-2]
+            d_row = end_of_snake[0] - piece_before_end[0]
+            d_col = end_of_snake[1] - piece_before_end[1]
+            if d_row in (1, -1):
+                grown = (end_of_snake[0] + d_row, end_of_snake[1])
+            elif d_col in (1, -1):
+                grown = (end_of_snake[0], end_of_snake[1] + d_col)
+            else:
+                return None
+        if not self.on_board(grown):
+            return None
+        return grown
+
+    # Method to undo a move returned by make_move
+    def unmake_move(self, undo):
+        tail, tail_link, ate, grown = undo
+        if grown is not None:
+            self.body.pop()
+            link = self.links.pop()
+            self.hash ^= self.key(grown, link)
+            self.release(grown)
+        if ate:
+            self.set_food(self.body[0])
+
+        self.body.append(tail)
+        self.links.append(tail_link)
+        self.hash ^= self.key(tail, tail_link)
+        self.occupy(tail)
+
+        target = self.body.popleft()
+        self.links.popleft()
+        self.hash ^= self.key(target, HEAD)
+        self.release(target)
+
+        head = self.body[0]
+        self.hash ^= self.key(head, self.links[0]) ^ self.key(head, HEAD)
+        self.links[0] = HEAD
+
+    # Method to put one snake segment on a cell
+    def occupy(self, cell):
+        count = self.occupied.get(cell, 0)
+        self.occupied[cell] = count + 1
+        if count == 0 and self.empty is not None and cell in self.empty_index:
+            # Swap the last empty cell into the covered cell's place
+            index = self.empty_index.pop(cell)
+            last = self.empty.pop()
+            if last != cell:
+                self.empty[index] = last
+                self.empty_index[last] = index
+
+    # Method to take one snake segment off a cell
+    def release(self, cell):
+        count = self.occupied[cell] - 1
+        if count:
+            self.occupied[cell] = count
+        else:
+            del self.occupied[cell]
+            if self.empty is not None and self.on_board(cell):
+                self.empty_index[cell] = len(self.empty)
+                self.empty.append(cell)
+
+    # Method to return the list of empty cells
+    def empty_cells(self):
+        if self.empty is None:
+            self.empty = [(r, c) for r in range(self.num_rows)
+                          for c in range(self.num_cols)
+                          if (r, c) not in self.occupied]
+            self.empty_index = {cell: i for i, cell in enumerate(self.empty)}
+        return self.empty
+
+    # Method to check if a cell is on the board
+    def on_board(self, cell):
+        return 0 <= cell[0] < self.num_rows and 0 <= cell[1] < self.num_cols
+
+
+class TranspositionTable:
+    """ Bounded table of searched positions with LRU eviction """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    # Method to return the stored value if it was searched to this depth
+    # Values searched to other depths score meals differently, so they are
+    # not reused
+    def lookup(self, key, depth):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != depth:
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    # Method to store a value, evicting the least recently used entry if full
+    def store(self, key, depth, value):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        self.entries[key] = (depth, value)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ExpectimaxSearch:
+    """ Expectimax search over snake moves and food placement """
+    def __init__(self, num_rows, num_cols, depth, table_size=100000,
+                 food_samples=8, seed=0, zobrist=None):
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.depth = depth
+        self.table_size = table_size
+        self.food_samples = food_samples
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.table = TranspositionTable(table_size)
+
+        # The keys only depend on the seed so that every worker agrees and
+        # searches with the same settings can share them; the last key
+        # marks positions searched with wraparound activated
+        if zobrist is None:
+            # Seeded apart from the food samples so the two streams differ
+            key_random = random.Random("{}:zobrist".format(seed))
+            zobrist = [key_random.getrandbits(64)
+                       for i in range(num_rows * num_cols * NUM_KINDS + 1)]
+        self.zobrist = zobrist
+
+    # Method to build a search state from the current model
+    def state_from_model(self, model):
+        return SearchState(self.num_rows, self.num_cols, model.snake_cells,
+                           model.food, model.wraparound, self.zobrist)
+
+    # Method to return the best direction for the model and its value
+    # If an executor is given, each root move is searched in its own task
+    # by a search that the worker thread or process keeps between calls,
+    # each with its own transposition table
+    def best_move(self, model, executor=None):
+        if executor is None:
+            state = self.state_from_model(model)
+            values = [self.move_value(state, index, self.depth)
+                      for index in range(len(DIRECTIONS))]
+        else:
+            snapshot = (list(model.snake_cells), model.food, model.wraparound)
+            settings = (self.num_rows, self.num_cols, self.table_size,
+                        self.food_samples, self.seed)
+            # Threads can use these keys directly instead of building them
+            zobrist = None
+            if isinstance(executor, ThreadPoolExecutor):
+                zobrist = self.zobrist
+            tasks = [executor.submit(search_root_move, settings, snapshot,
+                                     index, self.depth, zobrist)
+                     for index in range(len(DIRECTIONS))]
+            values = [task.result() for task in tasks]
+
+        best = max(range(len(DIRECTIONS)), key=lambda index: values[index])
+        return DIRECTIONS[best], values[best]
+
+    # Method to compute the value of moving in a direction
+    # A meal is worth one point for every ply left in the search, including
+    # the move that eats, so eating a ply earlier gains a full point; since
+    # evaluate() stays within one point of zero, an earlier meal always wins
+    def move_value(self, state, index, depth):
+        undo = state.make_move(index)
+        if undo is None:
+            return DEATH_VALUE - depth
+        ate = undo[2]
+        if ate:
+            value = depth + self.food_value(state, depth - 1)
+        else:
+            value = self.value(state, depth - 1)
+        state.unmake_move(undo)
+        return value
+
+    # Method to compute the value of a position where the snake moves next
+    def value(self, state, depth):
+        if depth <= 0:
+            return self.evaluate(state)
+        stored = self.table.lookup(state.hash, depth)
+        if stored is not None:
+            return stored
+
+        value = max(self.move_value(state, index, depth)
+                    for index in range(len(DIRECTIONS)))
+        self.table.store(state.hash, depth, value)
+        return value
+
+    # Method to compute the expected value over the new food location
+    # At the search horizon this is the average evaluation of the sampled
+    # food locations
+    def food_value(self, state, depth):
+        cells = self.food_cells(state)
+        if not cells:
+            return FULL_BOARD_VALUE
+
+        total = 0.0
+        for cell in cells:
+            state.set_food(cell)
+            total += self.value(state, depth)
+            state.clear_food()
+        return total / len(cells)
+
+    # Method to choose the food locations to average over
+    # Every empty cell is used when there are few of them, otherwise a
+    # sample is drawn uniformly from the empty cells like
+    # SnakeModel.make_food does, without retrying on covered cells
+    def food_cells(self, state):
+        empty = state.empty_cells()
+        if len(empty) <= self.food_samples:
+            return list(empty)
+        return self.random.sample(empty, self.food_samples)
+
+    # Method to score a position at the search horizon
+    # Being closer to the food is better, by less than one point
+    def evaluate(self, state):
+        if state.food is None:
+            return 0.0
+        head = state.body[0]
+        d_row = abs(head[0] - state.food[0])
+        d_col = abs(head[1] - state.food[1])
+        if state.wraparound:
+            d_row = min(d_row, self.num_rows - d_row)
+            d_col = min(d_col, self.num_cols - d_col)
+        return -(d_row + d_col) / (self.num_rows + self.num_cols)
+
+
+# Searches kept by each worker thread or process, keyed by their settings
+worker_searches = threading.local()
+
+
+# Function to return the search a worker uses for the given settings
+def worker_search(settings, depth, zobrist=None):
+    searches = getattr(worker_searches, "searches", None)
+    if searches is None:
+        searches = {}
+        worker_searches.searches = searches
+    search = searches.get(settings)
+    if search is None:
+        num_rows, num_cols, table_size, food_samples, seed = settings
+        search = ExpectimaxSearch(num_rows, num_cols, depth, table_size,
+                                  food_samples, seed, zobrist)
+        searches[settings] = search
+    return search
+
+
+# Function to search a single root move, used by the thread and process pools
+def search_root_move(settings, snapshot, index, depth, zobrist=None):
+    search = worker_search(settings, depth, zobrist)
+    snake_cells, food, wraparound = snapshot
+    state = SearchState(search.num_rows, search.num_cols, snake_cells, food,
+                        wraparound, search.zobrist)
+    return search.move_value(state, index, depth)
@@ -0,0 +1,139 @@
+"""
+Tests for the flood-fill board analysis against a brute-force search
+"""
+
+import random
+from collections import deque
+
+from snake7 import SnakeModel, Direction
+from board_analysis import BoardAnalyzer
+
+
+DIRECTION_DELTAS = {Direction.NORTH: (-1, 0), Direction.SOUTH: (1, 0),
+                    Direction.WEST: (0, -1), Direction.EAST: (0, 1)}
+
+
+# Function to return the cell a step away, or None if it leaves the board
+def step_cell(model, cell, delta):
+    row = cell[0] + delta[0]
+    col = cell[1] + delta[1]
+    if not (0 <= row < model.num_rows and 0 <= col < model.num_cols):
+        if not model.wraparound:
+            return None
+        row %= model.num_rows
+        col %= model.num_cols
+    return (row, col)
+
+
+# Function to return the body after moving in the given direction the way
+# SnakeModel.one_step and grow_snake do, or None if the move is fatal
+def next_body(model, direction):
+    target = step_cell(model, model.snake_head, DIRECTION_DELTAS[direction])
+    if target is None or target in model.snake_cells[:-1]:
+        return None
+    body = [target] + model.snake_cells[:-1]
+    if target != model.food:
+        return body
+
+    end_of_snake = body[-1]
+    if len(body) == 1:
+        d_row = -DIRECTION_DELTAS[direction][0]
+        d_col = -DIRECTION_DELTAS[direction][1]
+    else:
+        d_row = end_of_snake[0] - body[-2][0]
+        d_col = end_of_snake[1] - body[-2][1]
+        if d_row not in (1, -1) and d_col not in (1, -1):
+            return body
+    grown = (end_of_snake[0] + d_row, end_of_snake[1] + d_col)
+    if 0 <= grown[0] < model.num_rows and 0 <= grown[1] < model.num_cols:
+        body.append(grown)
+    return body
+
+
+# Function to count the empty cells reachable from the head of a body and
+# check if its tail is reachable, with a breadth-first search over cells
+def brute_force(model, body):
+    occupied = set(body)
+    goal = body[-1]
+    seen = {body[0]}
+    queue = deque([body[0]])
+    tail_reachable = goal == body[0]
+    while queue:
+        cell = queue.popleft()
+        for delta in DIRECTION_DELTAS.values():
+            neighbour = step_cell(model, cell, delta)
+            if neighbour is None:
+                continue
+            if neighbour == goal:
+                tail_reachable = True
+            if neighbour in occupied or neighbour in seen:
+                continue
+            seen.add(neighbour)
+            queue.append(neighbour)
+    return len(seen) - 1, tail_reachable
+
+
+# Function to check that the regions split the empty cells into connected
+# pieces and that every cell is labelled with its own region
+def check_regions(analyzer, model):
+    free = analyzer.full_mask & ~analyzer.snake_mask
+    covered = 0
+    for region in analyzer.regions:
+        assert region and not covered & region
+        covered |= region
+        assert analyzer.flood_fill(region & -region, region) == region
+    assert covered == free
+
+    for region_id, region in analyzer.region_cells.items():
+        assert analyzer.region_sizes[region_id] == bin(region).count("1")
+    for index in range(model.num_rows * model.num_cols):
+        region_id = analyzer.region_of(index)
+        if free >> index & 1:
+            assert analyzer.region_cells[region_id] >> index & 1
+        else:
+            assert region_id is None
+
+
+def test_analysis_matches_brute_force():
+    random.seed(1)
+    for game in range(60):
+        num_rows = random.randint(2, 10)
+        num_cols = random.randint(2, 10)
+        model = SnakeModel(num_rows, num_cols)
+        model.wraparound = game % 2 == 1
+        analyzer = BoardAnalyzer(model)
+        for tick in range(150):
+            if random.random() < 0.03:
+                model.wraparound = not model.wraparound
+            analysis = analyzer.analyze()
+            check_regions(analyzer, model)
+
+            bodies = {}
+            for direction in Direction:
+                body = next_body(model, direction)
+                if body is None:
+                    assert not analysis[direction].is_safe
+                else:
+                    bodies[direction] = body
+                    assert ((analysis[direction].region_size,
+                             analysis[direction].tail_reachable)
+                            == brute_force(model, body))
+            if not bodies:
+                break
+
+            direction = random.choice(list(bodies))
+            model.direction = direction
+            model.start_time -= 1
+            try:
+                model.one_step()
+            except (UnboundLocalError, IndexError):
+                # grow_snake fails to place the new segment
+                break
+            if model.game_over or not all(
+                    0 <= row < num_rows and 0 <= col < num_cols
+                    for row, col in model.snake_cells):
+                break
+            assert model.snake_cells == bodies[direction]
+            if len(set(model.snake_cells)) >= num_rows * num_cols - 2:
+                # make_food cannot place food on a full board
+                break
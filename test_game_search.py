@@ -0,0 +1,123 @@
+"""
+Tests for the expectimax lookahead search
+"""
+
+import random
+
+from snake7 import SnakeModel, Direction
+from game_search import ExpectimaxSearch, SearchState
+
+
+# Function to build a model with the snake and food at the given cells
+def make_model(num_rows, num_cols, snake_cells, food, wraparound=False):
+    model = SnakeModel(num_rows, num_cols)
+    model.snake_cells = list(snake_cells)
+    model.snake_head = snake_cells[0]
+    model.food = food
+    model.wraparound = wraparound
+    return model
+
+
+def test_deep_search_eats_adjacent_food():
+    model = make_model(8, 8, [(3, 4), (3, 5), (3, 6)], (3, 3))
+    for depth in (3, 4):
+        search = ExpectimaxSearch(8, 8, depth)
+        assert search.best_move(model)[0] == Direction.WEST
+
+
+def test_deep_search_heads_for_food_two_moves_away():
+    model = make_model(8, 8, [(3, 4), (3, 5), (3, 6)], (3, 2))
+    for depth in (3, 4):
+        search = ExpectimaxSearch(8, 8, depth)
+        assert search.best_move(model)[0] == Direction.WEST
+
+    model = make_model(8, 8, [(3, 4), (3, 5), (3, 6)], (2, 3))
+    for depth in (3, 4):
+        search = ExpectimaxSearch(8, 8, depth)
+        assert search.best_move(model)[0] in (Direction.NORTH, Direction.WEST)
+
+
+def test_earlier_meal_scores_higher():
+    model = make_model(8, 8, [(3, 4), (3, 5), (3, 6)], (3, 2))
+    search = ExpectimaxSearch(8, 8, 3)
+    state = search.state_from_model(model)
+    west = search.move_value(state, list(Direction).index(Direction.WEST), 3)
+    north = search.move_value(state, list(Direction).index(Direction.NORTH), 3)
+    assert west > north
+
+
+def test_deep_search_keeps_eating_in_play():
+    random.seed(1)
+    model = SnakeModel(10, 10)
+    search = ExpectimaxSearch(10, 10, 3, seed=1)
+    for tick in range(100):
+        model.direction = search.best_move(model)[0]
+        # Let a second pass per tick so the model's point rate is defined
+        model.start_time -= 1
+        model.one_step()
+        assert not model.game_over
+    assert model.point_standing >= 5
+
+
+def test_moves_match_model():
+    random.seed(2)
+    for game in range(40):
+        num_rows = random.randint(3, 8)
+        num_cols = random.randint(3, 8)
+        model = SnakeModel(num_rows, num_cols)
+        model.wraparound = game % 2 == 1
+        search = ExpectimaxSearch(num_rows, num_cols, 1, seed=game)
+        for tick in range(200):
+            state = search.state_from_model(model)
+            direction = random.choice(list(Direction))
+            undo = state.make_move(list(Direction).index(direction))
+            if undo is None:
+                break
+            model.direction = direction
+            model.start_time -= 1
+            try:
+                model.one_step()
+            except (UnboundLocalError, IndexError):
+                # grow_snake fails to place the new segment
+                break
+            if model.game_over or not all(
+                    0 <= row < num_rows and 0 <= col < num_cols
+                    for row, col in model.snake_cells):
+                break
+            assert list(state.body) == model.snake_cells
+            if len(set(model.snake_cells)) >= num_rows * num_cols - 1:
+                # make_food cannot place food on a full board
+                break
+
+
+def test_hash_matches_fresh_state_on_narrow_boards():
+    random.seed(3)
+    for game in range(60):
+        # Two directions take the same step on boards one or two cells wide
+        num_rows, num_cols = random.choice([(2, 6), (6, 2), (2, 2), (1, 7)])
+        wraparound = game % 2 == 1
+        search = ExpectimaxSearch(num_rows, num_cols, 1, seed=game)
+        start = (random.randrange(num_rows), random.randrange(num_cols))
+        state = SearchState(num_rows, num_cols, [start], None, wraparound,
+                            search.zobrist)
+        state.set_food(random.choice(state.empty_cells()))
+        # Each move made with whether food was placed after it, which is
+        # taken off again before the move is undone like the search does
+        moves = []
+        for step in range(100):
+            if moves and random.random() < 0.3:
+                undo, placed = moves.pop()
+                if placed:
+                    state.clear_food()
+                state.unmake_move(undo)
+            else:
+                undo = state.make_move(random.randrange(len(Direction)))
+                if undo is None:
+                    continue
+                placed = state.food is None and bool(state.empty_cells())
+                if placed:
+                    state.set_food(random.choice(state.empty_cells()))
+                moves.append((undo, placed))
+            fresh = SearchState(num_rows, num_cols, list(state.body),
+                                state.food, wraparound, search.zobrist)
+            assert state.hash == fresh.hash